@@ -159,6 +159,10 @@ class PostgreSQLAdapter(AbstractAdapter):
             keep_history=self.keep_history
         )
 
+    def close(self):
+        super(PostgreSQLAdapter, self).close()
+        self.connmanager.drain_pool()
+
     def new_instance(self):
         inst = type(self)(
             dsn=self._dsn,
@@ -16,6 +16,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import logging
+import threading
 
 from ..._util import metricmethod
 from ..connmanager import AbstractConnectionManager
@@ -26,15 +27,132 @@ logger = logging.getLogger(__name__)
 
 class Psycopg2ConnectionManager(AbstractConnectionManager):
 
+    #: Keep up to this many closed-but-healthy connections around for
+    #: reuse by :meth:`open`, skipping the TCP/TLS/authentication
+    #: handshake (several milliseconds each, much more with TLS).
+    #: Set to 0 to disable pooling. Configured with the
+    #: ``connection-pool-size`` option.
+    pool_size = 4
+
+    #: libpq keepalive parameters appended to the DSN (unless the
+    #: configuration already mentions keepalives) so dead peers are
+    #: detected in bounded time instead of after a full TCP timeout.
+    #: This matters more now that idle connections can sit in the pool.
+    _keepalive_dsn_params = (
+        "keepalives=1 keepalives_idle=60 keepalives_interval=15 keepalives_count=4"
+    )
+
     def __init__(self, driver, dsn, options):
+        # A DSN can also be a connection URI; appending key=value
+        # words to one of those makes it invalid, so those users get
+        # no keepalives unless they put them in the URI themselves.
+        is_uri = dsn.startswith(('postgresql://', 'postgres://'))
+        if self._driver_uses_libpq(driver) and not is_uri and 'keepalives' not in dsn:
+            dsn = ("%s %s" % (dsn, self._keepalive_dsn_params)).strip()
         self._dsn = dsn
         self.isolation_read_committed = driver.ISOLATION_LEVEL_READ_COMMITTED
         self.isolation_serializable = driver.ISOLATION_LEVEL_SERIALIZABLE
         self.isolation_repeatable_read = driver.ISOLATION_LEVEL_REPEATABLE_READ
         self.keep_history = options.keep_history
         self._db_connect_with_isolation = driver.connect_with_isolation
+        self.pool_size = options.connection_pool_size
+        # List of (pool_key, connection). Guarded by the lock; small,
+        # so a linear scan is fine.
+        self._pool = []
+        self._pool_lock = threading.Lock()
         super(Psycopg2ConnectionManager, self).__init__(options, driver)
 
+    @staticmethod
+    def _driver_uses_libpq(driver):
+        # pg8000 parses the DSN itself and passes every key=value
+        # pair as a keyword to its connection class, which doesn't
+        # know the keepalive family (or any other libpq-only
+        # parameter); only libpq-based drivers can see them.
+        return getattr(driver.driver_module, '__libpq_version__', 0) > 0
+
+    def _checkout_pooled_connection(self, pool_key):
+        with self._pool_lock:
+            for i, (key, conn) in enumerate(self._pool):
+                if key == pool_key:
+                    del self._pool[i]
+                    return conn
+        return None
+
+    def _return_to_pool(self, conn):
+        """
+        Accept *conn* into the pool if it's idle and healthy.
+        Return True if pooled (the caller must then not close it).
+        """
+        if not self.pool_size:
+            return False
+        try:
+            pool_key = conn._rs_pool_key
+            if conn.closed or (
+                    conn.info.transaction_status != self.driver.TS_NOT_NEEDROLLBACK):
+                return False
+        except (AttributeError,) + self._ignored_exceptions: # pylint:disable=catching-non-exception
+            # Drivers whose connections we never tagged (e.g., pg8000),
+            # or a connection in an unusable state.
+            return False
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append((pool_key, conn))
+                return True
+        return False
+
+    def _open_pooled(self, pool_key, isolation, read_only, deferrable):
+        """
+        Try to produce a ``(conn, cursor)`` pair from the pool,
+        reconfigured for the requested session. Returns None if the
+        pool has nothing usable.
+        """
+        while True:
+            conn = self._checkout_pooled_connection(pool_key)
+            if conn is None:
+                return None
+            try:
+                # DISCARD ALL wipes the session state the previous
+                # user left behind --- temporary tables and the
+                # triggers on them, prepared statements, GUC settings
+                # --- so the on-opened hooks can run their DDL again
+                # as if the connection were new. It also doubles as
+                # the liveness probe: one cheap round trip. It refuses
+                # to run inside a transaction block, so take the
+                # connection through autocommit for it.
+                conn.autocommit = True
+                cursor = self.cursor_for_connection(conn)
+                cursor.execute('DISCARD ALL')
+                conn.autocommit = False
+                # Explicit values (not the connect-time shortcuts) so any
+                # session state from the previous user is overwritten.
+                conn.set_session(isolation_level=isolation,
+                                 readonly=bool(read_only),
+                                 deferrable=bool(deferrable))
+            except self._ignored_exceptions: # pylint:disable=catching-non-exception
+                logger.debug("Pooled connection %r unusable; discarding", conn, exc_info=True)
+                super(Psycopg2ConnectionManager, self).close(conn)
+            else:
+                return conn, cursor
+
+    def close(self, conn=None, cursor=None):
+        # The superclass close is what carries the metric.
+        if conn is not None and self._return_to_pool(conn):
+            conn = None
+        return super(Psycopg2ConnectionManager, self).close(conn, cursor)
+
+    def drain_pool(self):
+        """
+        Close every connection waiting in the pool.
+
+        The adapter calls this when the storage shuts down;
+        otherwise up to :attr:`pool_size` live server connections
+        would linger until garbage collection.
+        """
+        with self._pool_lock:
+            pooled, self._pool = self._pool, []
+        for _key, conn in pooled:
+            super(Psycopg2ConnectionManager, self).close(conn)
+
 
     def _alter_dsn(self, replica):
         """Alter the DSN to use the specified replica.
@@ -48,6 +166,40 @@ class Psycopg2ConnectionManager(AbstractConnectionManager):
             dsn = '%s host=%s' % (self._dsn, replica)
         return dsn
 
+    def _multihost_dsn(self, replicas, read_only=False):
+        """
+        Alter the DSN to list *all* the replicas, letting libpq probe
+        them in a single connection attempt instead of one Python
+        round trip per replica.
+
+        libpq wants either no ports, or exactly one port per host, so
+        the default port is filled in when the replicas mix the
+        host and host:port forms.
+        """
+        hosts = []
+        ports = []
+        for replica in replicas:
+            if ':' in replica:
+                host, port = replica.split(':')
+            else:
+                host, port = replica, '5432'
+            hosts.append(host)
+            ports.append(port)
+        dsn = '%s host=%s' % (self._dsn, ','.join(hosts))
+        if any(':' in replica for replica in replicas):
+            dsn += ' port=%s' % (','.join(ports),)
+        # 'read-only' and friends need libpq 14; these two are
+        # understood everywhere target_session_attrs is (libpq 10+).
+        dsn += ' target_session_attrs=%s' % (
+            'any' if read_only else 'read-write',)
+        return dsn
+
+    def _can_use_multihost_dsn(self):
+        # Multi-host DSNs and target_session_attrs arrived with libpq
+        # 10 / psycopg2 2.8. pg8000 doesn't use libpq and doesn't
+        # understand them at all.
+        return getattr(self.driver.driver_module, '__libpq_version__', 0) >= 100000
+
     @metricmethod
     def open(self, isolation=None, read_only=False, deferrable=False,
              replica_selector=None, application_name=None, **kwargs):
@@ -59,14 +211,32 @@ class Psycopg2ConnectionManager(AbstractConnectionManager):
         if replica_selector is None:
             replica_selector = self.replica_selector
 
+        multihost = False
         if replica_selector is not None:
             replica = replica_selector.current()
-            dsn = self._alter_dsn(replica)
+            if self._can_use_multihost_dsn():
+                replicas = replica_selector.all_replicas()
+                multihost = len(replicas) > 1
+            if multihost:
+                # libpq does the failover itself; ``replica`` stays
+                # what the selector considers current so that
+                # check_replica still notices configuration changes.
+                dsn = self._multihost_dsn(replicas, read_only=read_only)
+            else:
+                dsn = self._alter_dsn(replica)
         else:
             replica = None
             dsn = self._dsn
 
         while True:
+            # The key includes the application name because that's
+            # session-level state we can't cheaply rewrite on reuse.
+            pool_key = (dsn, application_name)
+            pooled = self._open_pooled(pool_key, isolation, read_only, deferrable)
+            if pooled is not None:
+                conn, cursor = pooled
+                conn.replica = replica
+                return conn, cursor
             try:
                 # psycopg2 seems to have a cache of Connection objects
                 # so closing one and then opening again often gets the same
@@ -80,8 +250,24 @@ class Psycopg2ConnectionManager(AbstractConnectionManager):
                 )
                 cursor = self.cursor_for_connection(conn)
                 conn.replica = replica
+                try:
+                    conn._rs_pool_key = pool_key
+                except AttributeError:
+                    # Not all drivers' connection classes have the slot
+                    # (pg8000); those simply never get pooled.
+                    pass
                 return conn, cursor
             except self.driver.use_replica_exceptions as e:
+                if multihost:
+                    # libpq already probed every host. Defensively drop
+                    # back to the one-at-a-time loop in case the server
+                    # rejected the multi-host parameters themselves.
+                    multihost = False
+                    logger.warning(
+                        "Unable to connect with multi-host DSN: %s; "
+                        "retrying replicas individually", e)
+                    dsn = self._alter_dsn(replica)
+                    continue
                 if replica is not None:
                     next_replica = replica_selector.next()
                     if next_replica is not None:
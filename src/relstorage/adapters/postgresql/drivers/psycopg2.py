@@ -84,8 +84,10 @@ class Psycopg2Driver(MemoryViewBlobDriverMixin,
         if getattr(mod, 'RSPsycopg2Connection', self) is self:
             class RSPsycopg2Connection(mod.extensions.connection):
                 # The replica attribute holds the name of the replica this
-                # connection is bound to.
-                __slots__ = ('replica',) + extra_slots
+                # connection is bound to. The pool key is how the
+                # connection manager tags connections eligible for reuse;
+                # see Psycopg2ConnectionManager.
+                __slots__ = ('replica', '_rs_pool_key') + extra_slots
 
             mod.RSPsycopg2Connection = RSPsycopg2Connection
 
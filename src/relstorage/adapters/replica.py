@@ -82,6 +82,17 @@ class ReplicaSelector(object):
             self._select(0)
         return self._current_replica
 
+    def all_replicas(self):
+        """
+        Return a copy of all the configured replicas, in
+        configuration order, re-reading the configuration file if it
+        has changed.
+        """
+        if self._is_config_modified():
+            self._read_config()
+            self._select(0)
+        return list(self._replicas)
+
     @metricmethod
     def next(self):
         """Return the next replica to try.
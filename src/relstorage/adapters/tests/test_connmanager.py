@@ -28,6 +28,7 @@ from relstorage.tests import DisconnectedException
 from relstorage.tests import CloseException
 
 from relstorage.adapters.connmanager import AbstractConnectionManager
+from relstorage.adapters.postgresql.connmanager import Psycopg2ConnectionManager
 from relstorage.adapters import interfaces
 
 class TestAbstractConnectionManager(TestCase):
@@ -259,3 +260,240 @@ class TestAbstractConnectionManager(TestCase):
         conn.replica = 'other'
         self.assertRaises(interfaces.ReplicaClosedException,
                           cm.restart_load, conn, MockCursor())
+
+
+class MockPsycopg2Connection(MockConnection):
+    # Just enough of the psycopg2 connection interface for
+    # Psycopg2ConnectionManager.
+
+    class _Info(object):
+        transaction_status = 'idle'
+
+    autocommit = False
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.sessions = []
+        self.info = self._Info()
+
+    def set_session(self, isolation_level=None, readonly=None, deferrable=None):
+        self.sessions.append((isolation_level, readonly, deferrable))
+
+
+class MockPsycopg2Driver(MockDriver):
+    # Just enough of the psycopg2 driver interface for
+    # Psycopg2ConnectionManager. By default the mock driver module
+    # does not claim to be based on libpq.
+
+    ISOLATION_LEVEL_READ_COMMITTED = 'READ COMMITTED'
+    ISOLATION_LEVEL_SERIALIZABLE = 'SERIALIZABLE'
+    ISOLATION_LEVEL_REPEATABLE_READ = 'REPEATABLE READ'
+    TS_NOT_NEEDROLLBACK = MockPsycopg2Connection._Info.transaction_status
+    use_replica_exceptions = (DisconnectedException,)
+
+    def __init__(self):
+        self.driver_module = type('driver_module', (), {})()
+        self.connections = []
+
+    def connect_with_isolation(self, dsn,
+                               isolation=None,
+                               read_only=False,
+                               deferrable=False,
+                               application_name=None):
+        conn = MockPsycopg2Connection(dsn)
+        self.connections.append(conn)
+        return conn
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+
+class TestPsycopg2ConnectionManager(TestCase):
+
+    dsn = 'dbname=test'
+
+    def _makeOne(self, driver=None, dsn=None, **options):
+        return Psycopg2ConnectionManager(
+            driver if driver is not None else MockPsycopg2Driver(),
+            dsn if dsn is not None else self.dsn,
+            MockOptions.from_args(**options)
+        )
+
+    def test_no_keepalives_without_libpq(self):
+        cm = self._makeOne()
+        self.assertEqual(cm._dsn, self.dsn)
+
+    def test_keepalives_with_libpq(self):
+        driver = MockPsycopg2Driver()
+        driver.driver_module.__libpq_version__ = 100001
+        cm = self._makeOne(driver)
+        self.assertIn('keepalives=1', cm._dsn)
+
+    def test_no_keepalives_in_uri_dsn(self):
+        # key=value words appended to a connection URI would make it
+        # invalid.
+        driver = MockPsycopg2Driver()
+        driver.driver_module.__libpq_version__ = 100001
+        for uri in 'postgresql://h/db', 'postgres://h/db':
+            cm = self._makeOne(driver, dsn=uri)
+            self.assertEqual(cm._dsn, uri)
+
+    def test_keepalives_not_overridden(self):
+        driver = MockPsycopg2Driver()
+        driver.driver_module.__libpq_version__ = 100001
+        cm = self._makeOne(driver, dsn='dbname=test keepalives=0')
+        self.assertEqual(cm._dsn, 'dbname=test keepalives=0')
+
+    def test_close_returns_to_pool_and_open_reuses(self):
+        cm = self._makeOne()
+        conn, cursor = cm.open()
+        self.assertTrue(cm.close(conn, cursor))
+        # The connection is waiting in the pool, not closed.
+        self.assertFalse(conn.closed)
+
+        conn2, cursor2 = cm.open()
+        self.assertIs(conn2, conn)
+        # The reused connection had its session wiped (which also
+        # probes for liveness) and was reconfigured for the requested
+        # session, outside of autocommit again.
+        self.assertIn(('DISCARD ALL', None), cursor2.executed)
+        self.assertFalse(conn.autocommit)
+        self.assertTrue(conn.sessions)
+
+        # It came out of the pool, so a third open can't have it.
+        conn3, _cursor3 = cm.open()
+        self.assertIsNot(conn3, conn)
+
+    def test_pool_size_zero_disables_reuse(self):
+        cm = self._makeOne(connection_pool_size=0)
+        self.assertEqual(cm.pool_size, 0)
+        conn, cursor = cm.open()
+        cm.close(conn, cursor)
+        self.assertTrue(conn.closed)
+
+    def test_pool_bounded_by_pool_size(self):
+        cm = self._makeOne(connection_pool_size=1)
+        conn1, cursor1 = cm.open()
+        conn2, cursor2 = cm.open()
+        cm.close(conn1, cursor1)
+        cm.close(conn2, cursor2)
+        self.assertFalse(conn1.closed)
+        self.assertTrue(conn2.closed)
+
+    def test_connection_in_transaction_not_pooled(self):
+        cm = self._makeOne()
+        conn, cursor = cm.open()
+        conn.info.transaction_status = 'in transaction'
+        cm.close(conn, cursor)
+        self.assertTrue(conn.closed)
+
+    def test_dead_pooled_connection_discarded(self):
+        cm = self._makeOne()
+        conn, cursor = cm.open()
+        cm.close(conn, cursor)
+        # It dies while it sits idle in the pool.
+        def boom(**_kwargs):
+            raise DisconnectedException
+        conn.set_session = boom
+
+        conn2, _cursor2 = cm.open()
+        self.assertIsNot(conn2, conn)
+        self.assertTrue(conn.closed)
+
+    def test_pool_key_includes_application_name(self):
+        cm = self._makeOne()
+        conn, cursor = cm.open(application_name='RS: Load')
+        cm.close(conn, cursor)
+        conn2, _cursor2 = cm.open(application_name='RS: Store')
+        self.assertIsNot(conn2, conn)
+
+    def test_drain_pool_closes_pooled_connections(self):
+        cm = self._makeOne()
+        conn, cursor = cm.open()
+        cm.close(conn, cursor)
+        self.assertFalse(conn.closed)
+
+        cm.drain_pool()
+        self.assertTrue(conn.closed)
+        # The pool is empty now; a new open gets a fresh connection.
+        conn2, _cursor2 = cm.open()
+        self.assertIsNot(conn2, conn)
+
+    def test_pooled_connection_reopened_for_store(self):
+        # The on-store-opened hooks run DDL (temporary tables, a
+        # trigger on them). Reuse must present as clean a session as
+        # a fresh connection, or re-running the hooks would collide
+        # with the leftovers.
+        cm = self._makeOne()
+        hook_restarts = []
+        cm.add_on_store_opened(
+            lambda _cursor, restart=False: hook_restarts.append(restart))
+
+        conn, cursor = cm.open_for_store()
+        cm.close(conn, cursor)
+
+        conn2, cursor2 = cm.open_for_store()
+        self.assertIs(conn2, conn)
+        # The session was wiped before the hooks ran again.
+        discard = cursor2.executed.index(('DISCARD ALL', None))
+        self.assertEqual(hook_restarts, [False, False])
+        self.assertEqual(discard, 0)
+
+    def _make_libpq_driver(self):
+        driver = MockPsycopg2Driver()
+        driver.driver_module.__libpq_version__ = 100001
+        return driver
+
+    def _make_replica_conf(self, contents=b'h1:5433\nh2\n'):
+        import os
+        import tempfile
+        fd, fn = tempfile.mkstemp('.rstest_replicas')
+        os.write(fd, contents)
+        os.close(fd)
+        self.addCleanup(os.remove, fn)
+        return fn
+
+    def test_can_use_multihost_dsn(self):
+        self.assertFalse(self._makeOne()._can_use_multihost_dsn())
+        self.assertTrue(self._makeOne(self._make_libpq_driver())._can_use_multihost_dsn())
+
+    def test_multihost_dsn_mixed_ports(self):
+        # The default port is filled in: libpq wants either no ports
+        # or one port per host.
+        cm = self._makeOne()
+        self.assertEqual(
+            cm._multihost_dsn(['h1:5433', 'h2']),
+            'dbname=test host=h1,h2 port=5433,5432 target_session_attrs=read-write')
+
+    def test_multihost_dsn_without_ports(self):
+        cm = self._makeOne()
+        self.assertEqual(
+            cm._multihost_dsn(['h1', 'h2'], read_only=True),
+            'dbname=test host=h1,h2 target_session_attrs=any')
+
+    def test_open_uses_multihost_dsn(self):
+        cm = self._makeOne(self._make_libpq_driver(),
+                           replica_conf=self._make_replica_conf())
+        conn, _cursor = cm.open()
+        self.assertIn('host=h1,h2', conn.dsn)
+        self.assertIn('port=5433,5432', conn.dsn)
+        self.assertIn('target_session_attrs=read-write', conn.dsn)
+        # check_replica still sees what the selector considers current.
+        self.assertEqual(conn.replica, 'h1:5433')
+
+    def test_open_multihost_falls_back_to_replica_iteration(self):
+        driver = self._make_libpq_driver()
+        def connect_with_isolation(dsn, **_kwargs):
+            if 'target_session_attrs' in dsn:
+                # Say the server rejected the multi-host parameters.
+                raise DisconnectedException
+            conn = MockPsycopg2Connection(dsn)
+            driver.connections.append(conn)
+            return conn
+        driver.connect_with_isolation = connect_with_isolation
+        cm = self._makeOne(driver, replica_conf=self._make_replica_conf())
+
+        conn, _cursor = cm.open()
+        self.assertNotIn('target_session_attrs', conn.dsn)
+        self.assertIn('host=h1 port=5433', conn.dsn)
+        self.assertEqual(conn.replica, 'h1:5433')
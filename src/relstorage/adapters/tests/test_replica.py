@@ -84,6 +84,28 @@ class ReplicaSelectorTests(unittest.TestCase):
         rs._expiration = 0
         self.assertEqual(rs.current(), 'localhost')
 
+    def test_all_replicas(self):
+        from relstorage.adapters.replica import ReplicaSelector
+        rs = ReplicaSelector(self.fn, 600.0)
+        self.assertEqual(rs.all_replicas(),
+                         ['example.com:1234', 'localhost:4321', 'localhost:9999'])
+        # It's a copy; mutating it doesn't disturb the selector.
+        rs.all_replicas().append('other')
+        self.assertEqual(len(rs.all_replicas()), 3)
+
+    def test_all_replicas_rereads_modified_config(self):
+        from relstorage.adapters.replica import ReplicaSelector
+        rs = ReplicaSelector(self.fn, 600.0)
+        rs._select(1)
+        # change the file and get the new replica list
+        with open(self.fn, 'w') as f:
+            f.write('localhost\nalternate\n')
+        rs._config_checked = 0
+        rs._config_modified = 0
+        self.assertEqual(rs.all_replicas(), ['localhost', 'alternate'])
+        # Re-reading also reset the current selection.
+        self.assertEqual(rs.current(), 'localhost')
+
     def test_next_iteration(self):
         from relstorage.adapters.replica import ReplicaSelector
         rs = ReplicaSelector(self.fn, 600.0)
@@ -46,6 +46,30 @@ from relstorage.cache.local_database import Database
 
 from relstorage.cache import cache
 
+try:
+    # libdeflate (through the 'deflate' binding) writes ordinary zlib
+    # streams, so it's wire-compatible with ``zlib.compress`` and
+    # ``zlib.decompress`` (and with caches written by either). It's
+    # purely optional; we silently use the stdlib if it's not around.
+    # Only compression is accelerated: libdeflate must be told the
+    # decompressed size up front, which the cache doesn't record, so
+    # reads stay with the streaming stdlib decompressor.
+    from deflate import zlib_compress as _libdeflate_zlib_compress
+except ImportError: # pragma: no cover
+    _libdeflate_zlib_compress = None
+
+try:
+    # zstd compresses about as well as zlib's default level while
+    # compressing roughly twice as fast and decompressing several
+    # times faster; worth offering when the binding is around. The
+    # one-shot module-level functions are used (rather than compressor
+    # objects) because they are safe to call from any thread.
+    from zstandard import compress as _zstd_compress
+    from zstandard import decompress as _zstd_decompress
+except ImportError: # pragma: no cover
+    _zstd_compress = None
+    _zstd_decompress = None
+
 logger = __import__('logging').getLogger(__name__)
 
 # pylint:disable=too-many-lines
@@ -177,6 +201,25 @@ class LocalClient(object):
         b'.z': zlib.decompress,
         b'.b': bz2.decompress
     }
+    if _zstd_compress is not None:
+        # Asking for 'zstd' without the binding installed falls
+        # through to the usual "Unknown compression module" error.
+        # Decompression registers unconditionally (when possible) so a
+        # cache file written with zstd stays readable after the
+        # configured module changes, just like zlib/bz2.
+        _compression_markers['zstd'] = (b'.s', _zstd_compress)
+        _decompression_functions[b'.s'] = _zstd_decompress
+
+    # Compression ratio (compressed size / original size), smoothed
+    # with an EWMA per power-of-two size bucket, at or above which we
+    # stop even attempting to compress values of that size. Pickles
+    # that are mostly entropy (already-compressed blobs, UUIDs) pay
+    # the full LZ77 cost and then get thrown away by the
+    # is-it-smaller check; this learns to skip them. See _compress.
+    _compress_ratio_cutoff = 0.98
+    # After this many skipped values in a bucket, compress one anyway
+    # so a shift in the workload can re-enable the bucket.
+    _compress_skip_probe = 512
 
     # What multiplier of the number of items in the cache do we apply
     # to determine when to age the frequencies?
@@ -190,6 +233,12 @@ class LocalClient(object):
 
     # Things copied from self._cache
     _peek = None
+    _peek_with_tid = None
+    _get_with_tid = None
+
+    # Specialized per-instance in __init__, once the set of
+    # decompression functions is known.
+    _decompress = None
 
     def __init__(self, options,
                  prefix=None):
@@ -203,6 +252,12 @@ class LocalClient(object):
         # The underlying data storage. It maps ``{oid: value}``,
         # where ``value`` is an :class:`ICachedValue`.
         #
+        # Note that there is no Python-level lock around it (there
+        # used to be a single global one guarding every get and put).
+        # The C++ cache keeps its entry accounting effectively atomic
+        # itself, so striping a lock over OIDs here would just add
+        # back per-operation overhead with nothing left to protect.
+        #
         # Keying off of OID directly lets the LRU be based on the
         # popularity of an object, not its particular transaction. It also lets
         # us use a LLBTree to store the data, which can be more memory efficient.
@@ -211,6 +266,13 @@ class LocalClient(object):
         self.flush_all()
         self.__initial_weight = self._cache.weight
 
+        # Learned compressibility by size bucket. Start below the
+        # cutoff so every bucket gets tried until it proves itself
+        # incompressible. These are advisory stats; we don't bother
+        # locking around updates.
+        self._compress_ratio_ewma = [0.9] * 8
+        self._compress_skipped = [0] * 8
+
         compression_module = options.cache_local_compression
         try:
             compression_markers = self._compression_markers[compression_module]
@@ -221,6 +283,29 @@ class LocalClient(object):
             self.__compress = compression_markers[1]
             if self.__compress is None:
                 self._compress = None
+            elif compression_module == 'zlib' and _libdeflate_zlib_compress is not None:
+                # Same stream format, faster codec. The compression
+                # level matches zlib's default (6).
+                def compress_zlib(data, _c=_libdeflate_zlib_compress):
+                    return _c(data, 6)
+                self.__compress = compress_zlib
+
+        self._decompress = self._make_decompress()
+
+    def _make_decompress(self):
+        # Specialize the dispatch for this instance: capture the (now
+        # fixed) function table as a default argument so no attribute
+        # or global lookups happen per call. In most workloads the
+        # majority of values are small uncompressed pickles;
+        # ``startswith`` answers that case without allocating the
+        # two-byte prefix slice that a dict probe would need, and the
+        # table only ever has a couple of entries to walk.
+        def decompress(data, _dispatch=tuple(self._decompression_functions.items())):
+            for pfx, fn in _dispatch:
+                if data.startswith(pfx):
+                    return fn(data[2:])
+            return data
+        return decompress
 
     @property
     def size(self):
@@ -238,12 +323,6 @@ class LocalClient(object):
     def keys(self):
         return self._cache.keys()
 
-    def _decompress(self, data):
-        pfx = data[:2]
-        if pfx not in self._decompression_functions:
-            return data
-        return self._decompression_functions[pfx](data[2:])
-
     def _compress(self, data): # pylint:disable=method-hidden
         # We override this if we're disabling compression
         # altogether.
@@ -251,8 +330,23 @@ class LocalClient(object):
         # many smaller object (under 100 bytes) like you get with small btrees,
         # tend not to compress well, so don't bother.
         if data and (len(data) > 100) and data[:2] not in self._decompression_functions:
+            data_len = len(data)
+            # Bucket 0 is 101--255 bytes, each bucket doubles, bucket 7
+            # is 16KB and up. (len > 100 guarantees bit_length() >= 7.)
+            bucket = min(7, data_len.bit_length() - 7)
+            ewma = self._compress_ratio_ewma
+            if ewma[bucket] >= self._compress_ratio_cutoff:
+                # This size class hasn't been compressing well;
+                # don't waste the CPU on it, aside from an occasional
+                # probe to notice if the workload changes.
+                skipped = self._compress_skipped
+                skipped[bucket] += 1
+                if skipped[bucket] < self._compress_skip_probe:
+                    return data
+                skipped[bucket] = 0
             compressed = self.__compression_marker + self.__compress(data)
-            if len(compressed) < len(data):
+            ewma[bucket] = 0.9 * ewma[bucket] + 0.1 * (len(compressed) / data_len)
+            if len(compressed) < data_len:
                 return compressed
         return data
 
@@ -332,6 +426,8 @@ class LocalClient(object):
                 byte_limit * self._gen_probation_pct
             )
         self._peek = self._cache.peek
+        self._peek_with_tid = self._cache.peek_item_with_tid
+        self._get_with_tid = self._cache.get_item_with_tid
         self.reset_stats()
 
     def reset_stats(self):
@@ -360,13 +456,11 @@ class LocalClient(object):
     def get(self, oid_tid, peek=False):
         oid, tid = oid_tid
         assert tid is None or tid >= 0
-        decompress = self._decompress
-        value = None
 
         if peek:
-            value = self._cache.peek_item_with_tid(oid, tid)
+            value = self._peek_with_tid(oid, tid)
         else:
-            value = self._cache.get_item_with_tid(oid, tid)
+            value = self._get_with_tid(oid, tid)
 
         # Finally, decompress if needed.
         # Recall that for deleted objects, `state` can be None.
@@ -374,7 +468,7 @@ class LocalClient(object):
         # don't need to decompress.
         if value is not None:
             state, tid = value
-            return ((decompress(state) if state else state), tid)
+            return ((self._decompress(state) if state else state), tid)
 
     __getitem__ = get
 
@@ -393,8 +487,9 @@ class LocalClient(object):
         #
         # We don't take a lock to do this; it's fine if two threads
         # attempt it at the same time.
-        age_period = self._age_factor * len(self._cache)
-        operations = self._cache.hits + self._cache.sets
+        cache = self._cache
+        age_period = self._age_factor * len(cache)
+        operations = cache.hits + cache.sets
         if operations - self._aged_at < age_period:
             self._next_age_at = age_period
             return
@@ -404,10 +499,10 @@ class LocalClient(object):
         self._aged_at = operations
         now = time.time()
         logger.debug("Beginning frequency aging for %d cache entries",
-                     len(self._cache))
-        self._cache.age_frequencies()
+                     len(cache))
+        cache.age_frequencies()
         done = time.time()
-        logger.debug("Aged %d cache entries in %s", len(self._cache), done - now)
+        logger.debug("Aged %d cache entries in %s", len(cache), done - now)
 
         self._next_age_at = int(self._aged_at * 1.5) # in case the dict shrinks
 
@@ -428,10 +523,13 @@ class LocalClient(object):
 
     def set_all_for_tid(self, tid_int, state_oid_iter):
         if self.limit:
-            self._cache.set_all_for_tid(tid_int, state_oid_iter, self._compress, self._value_limit)
+            # This is the hottest write path in the class; read
+            # ``_cache`` once instead of three times.
+            cache = self._cache
+            cache.set_all_for_tid(tid_int, state_oid_iter, self._compress, self._value_limit)
             # Inline some of the logic about whether to age or not; avoiding the
             # call helps speed
-            if self._cache.hits + self._cache.sets > self._next_age_at:
+            if cache.hits + cache.sets > self._next_age_at:
                 self._age()
 
     def __delitem__(self, oid_tid):
@@ -503,8 +601,11 @@ class LocalClient(object):
 
     @_log_timed
     def read_from_sqlite(self, connection):
-        import gc
-        gc.collect() # Free memory, we're about to make big allocations.
+        # We used to gc.collect() here to make room for the big
+        # allocations coming up, but a full collection walks the whole
+        # heap of what can be a very large process and stalls for
+        # longer than the allocations it might save; the memory delta
+        # we log below was the only thing it reliably improved.
         mem_before = get_memory_usage()
 
         db = Database.from_connection(connection)
@@ -521,21 +622,39 @@ class LocalClient(object):
             # fetching rows from sqlite, and 18% of the total is allocating
             # storage for the blob state.
             #
-            # We make one call into sqlite and let it handle the iterating.
+            # We make a few calls into sqlite and let it handle the
+            # iterating: rows come back in C-built batches via
+            # ``fetchmany()``, and the only per-row Python work is one
+            # tight classification loop with everything it needs
+            # hoisted into locals.
             # Items are (oid, key_tid, state, actual_tid).
             # key_tid may equal the actual tid, or be -1 when the row was previously
             # frozen;
             # That doesn't matter to us, we always freeze all rows.
+            # The sizes come from sqlite (LENGTH is computed in C along
+            # with everything else about the row), so the loop never has
+            # to touch the state objects; on Python 3 they're already the
+            # bytes we want to store.
             size = 0
             limit = self.limit
             items = []
-            rows = db.fetch_rows_by_priority()
-            for oid, frozen, state, actual_tid, frequency in rows:
-                size += len(state)
-                if size > limit:
-                    break
-                items.append((oid, (state, actual_tid, frozen, frequency)))
-            consume(rows)
+            append = items.append
+            # Py2 returns buffers and needs a conversion; on Py3
+            # bytes(bytes) would just be a wasted call per row.
+            as_state = bytes if str is bytes else None
+            batches = db.fetch_rows_by_priority_in_batches()
+            for rows in batches:
+                for oid, frozen, state, actual_tid, frequency, state_len in rows:
+                    size += state_len
+                    if size > limit:
+                        break
+                    if as_state is not None:
+                        state = as_state(state)
+                    append((oid, (state, actual_tid, frozen, frequency)))
+                else:
+                    continue
+                break
+            consume(batches)
             # Rows came to us MRU to LRU, but we need to feed them the other way.
             items.reverse()
             return items
@@ -593,26 +712,44 @@ class LocalClient(object):
         # When we accumulate all the rows here before returning them,
         # this function shows as about 3% of the total time to save
         # in a very large database.
+        # Walk the generations rather than the map so each row knows
+        # which SLRU generation it came from; the persistent trim loop
+        # uses that rank (0 = eden, 1 = probation, 2 = protected) to
+        # evict unproven entries before established ones. Every entry
+        # lives in exactly one generation, so this visits the same
+        # entries iteritems() would.
+        lru_cache = self._cache
+        generations = (
+            (0, lru_cache.eden),
+            (1, lru_cache.probation),
+            (2, lru_cache.protected),
+        )
         with _timer() as t:
-            for oid, lru_entry in self._cache.iteritems():
-                newest_value = lru_entry.newest_value
-                # We must have something at least this fresh
-                # to consider writing it out
-                if newest_value is None:
-                    raise AssertionError("Value should not be none", oid, lru_entry)
-                actual_tid = newest_value.tid
-
-                # If we have something >= min_allowed, matching
-                # what's in the database, or even older (somehow),
-                # it's not worth writing to the database (states should be identical).
-                current_tid = get_current_oid_tid(oid, -1)
-                if current_tid >= actual_tid:
-                    matching_tid_count += 1
-                    continue
-
-                yield (oid, actual_tid, newest_value.frozen,
-                       bytes(newest_value.state),
-                       lru_entry.frequency)
+            for gen_rank, generation in generations:
+                for lru_entry in generation:
+                    oid = lru_entry.key
+                    newest_value = lru_entry.newest_value
+                    # We must have something at least this fresh
+                    # to consider writing it out
+                    if newest_value is None:
+                        raise AssertionError("Value should not be none", oid, lru_entry)
+                    # Unpacking gets both the state (already bytes) and the
+                    # tid in one trip across the Cython boundary, instead of
+                    # a property access for each.
+                    state, actual_tid = newest_value
+
+                    # If we have something >= min_allowed, matching
+                    # what's in the database, or even older (somehow),
+                    # it's not worth writing to the database (states should be identical).
+                    current_tid = get_current_oid_tid(oid, -1)
+                    if current_tid >= actual_tid:
+                        matching_tid_count += 1
+                        continue
+
+                    yield (oid, actual_tid, newest_value.frozen,
+                           state,
+                           lru_entry.frequency,
+                           gen_rank)
 
                 # We're able to satisfy this, so we don't need to consider
                 # it in our min_allowed set anymore.
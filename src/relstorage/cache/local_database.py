@@ -24,11 +24,12 @@ from __future__ import division
 from __future__ import print_function
 
 from abc import abstractmethod
+from binascii import hexlify
 from contextlib import closing
+import json
 import sqlite3
 
 from relstorage._compat import ABC
-from relstorage._compat import OID_TID_MAP_TYPE
 from relstorage._util import log_timed
 
 from relstorage.adapters.sqlite.batch import Sqlite3RowBatcher
@@ -37,6 +38,11 @@ from relstorage.adapters.sqlite.dialect import SQ3_SUPPORTS_UPSERT as SUPPORTS_U
 
 logger = __import__('logging').getLogger(__name__)
 
+#: Can ``store_temp`` hand sqlite the whole batch as one JSON array?
+#: ``unhex()`` (3.41) is the gating feature; ``json_each`` and the
+#: ``->>`` operator are older (3.38).
+SUPPORTS_JSON_BULK_LOAD = sqlite3.sqlite_version_info >= (3, 41, 0)
+
 class SimpleQueryProperty(object):
     """
     Wraps a query that returns one value in one row.
@@ -98,12 +104,19 @@ class Database(ABC):
     #
     # This reduces overhead of having a secondary (hidden) 'rowid' column
     # to do the clustering on, to it's important.
+    # The ``generation`` column records which SLRU generation of the
+    # in-memory cache the row was in when it was saved: 0 for eden, 1
+    # for probation, 2 for protected. Rows that only ever saw one
+    # burst of use (a scan) stay in the low generations, and the trim
+    # loop evicts those before touching rows with a demonstrated
+    # re-use history, no matter what raw frequency the scan gave them.
     _state_table_schema = """
     CREATE TABLE IF NOT EXISTS object_state (
         zoid INTEGER PRIMARY KEY,
         tid INTEGER NOT NULL ,
         was_frozen INT(1) NOT NULL DEFAULT 0,
         frequency INTEGER NOT NULL,
+        generation INT(1) NOT NULL DEFAULT 0,
         state BLOB
     );
     """
@@ -136,19 +149,84 @@ class Database(ABC):
         "SELECT COUNT(zoid) FROM object_state"
     )
 
+    # The statements the save/load paths execute repeatedly live here
+    # as class attributes: besides keeping the methods down to logic,
+    # passing the identical string object to every execute() lets the
+    # sqlite3 statement cache rule out re-parsing with a pointer
+    # comparison instead of hashing a freshly built string.
+
+    # Read these in priority order; as a tie-breaker, choose newer
+    # transactions over older transactions.
+    # We could use a window function over SUM(LENGTH(state)) to only select
+    # the rows that will actually fit:
+    #
+    # SELECT * FROM (
+    #  SELECT zoid, tid, state,
+    #   sum(length(state)) over (order by frequency desc, tid desc) as cum_size
+    #  FROM object_state
+    # ORDER BY frequency DESC, tid DESC
+    # )
+    # WHERE cum_size < ?
+    #
+    # However, that seems to generate a poor query plan that actually looks
+    # at all the rows (it doesn't understand that cum_size can only increase.)
+    # Plus, window functions were only added to sqlite 3.25
+    _fetch_rows_by_priority_sql = """
+    SELECT zoid, CASE was_frozen WHEN 1 THEN -1 ELSE tid END,
+           CAST(state AS BLOB), tid, frequency,
+           LENGTH(CAST(state AS BLOB))
+    FROM object_state
+    ORDER BY frequency DESC, tid DESC
+    """
+
+    _store_temp_sql = (
+        'INSERT INTO temp_state(zoid, tid, was_frozen, state, frequency, generation) '
+        'VALUES (?, ?, ?, ?, ?, ?)'
+    )
+
+    _store_temp_json_sql = """
+    INSERT INTO temp_state(zoid, tid, was_frozen, state, frequency, generation)
+    SELECT value->>0, value->>1, value->>2, unhex(value->>3), value->>4, value->>5
+    FROM json_each(?)
+    """
+
+    # Rows that never made it past eden or probation in memory go
+    # before anything the SLRU had promoted to protected; within a
+    # generation, the oldest, least used, biggest objects go first.
+    _trim_fetch_sql = """
+    SELECT zoid, LENGTH(state)
+    FROM object_state
+    ORDER BY generation ASC, frequency ASC, tid ASC,
+             LENGTH(CAST(state AS BLOB)) DESC, zoid ASC
+    """
+
     def create_schema(self):
         self.cursor.executescript(self._schema)
+        # Upgrade in place from files written before the generation
+        # column existed. The default ranks everything as most
+        # evictable, which is the conservative choice.
+        self.cursor.execute('PRAGMA table_info(object_state)')
+        columns = [row[1] for row in self.cursor.fetchall()]
+        if 'generation' not in columns:
+            self.cursor.execute(
+                'ALTER TABLE object_state ADD COLUMN '
+                'generation INT(1) NOT NULL DEFAULT 0'
+            )
 
     @log_timed
     def _read_oids_and_tids_from_db_to_map(self):
+        # ``fetchall()`` materializes the rows at the C level, and the
+        # dict constructor consumes the 2-tuples at the C level too.
+        # The callers only need ``.get()``, so a plain dict beats the
+        # specialized map types here.
         cur = self.connection.execute('SELECT zoid, tid FROM object_state')
         with closing(cur):
-            return OID_TID_MAP_TYPE(cur.fetchall())
+            return dict(cur.fetchall())
 
     oid_to_tid = property(_read_oids_and_tids_from_db_to_map,
                           doc="""
-        A map from OID to its corresponding TID, for
-        all the data in the database.
+        A dict mapping each OID in the database to its
+        corresponding TID.
         """)
 
     @property
@@ -199,35 +277,37 @@ class Database(ABC):
 
         You *must* completely consume the returned object.
         """
-        # Do this in a new cursor so it can interleave.
-
-        # Read these in priority order; as a tie-breaker, choose newer transactions
-        # over older transactions.
-        # We could  use a window function over SUM(LENGTH(state)) to only select
-        # the rows that will actually fit:
-        #
-        # SELECT * FROM (
-        #  SELECT zoid, tid, state,
-        #   sum(length(state)) over (order by frequency desc, tid desc) as cum_size
-        #  FROM object_state
-        # ORDER BY frequency DESC, tid DESC
-        # )
-        # WHERE cum_size < ?
-        #
-        # However, that seems to generate a poor query plan that actually looks
-        # at all the rows (it doesn't understand that cum_size can only increase.)
-        # Plus, window functions were only added to sqlite 3.25
         as_state = bytes # Py2 returns buffers, Py3 returns bytes. bytes(bytes) is a no-op.
+        for rows in self.fetch_rows_by_priority_in_batches():
+            for zoid, frozen, state, tid, frequency, _state_len in rows:
+                yield zoid, frozen, as_state(state), tid, frequency
+
+    def fetch_rows_by_priority_in_batches(self, batch_size=10000):
+        """
+        Like :meth:`fetch_rows_by_priority`, but yields lists of raw
+        rows ``(zoid, was_frozen, state, tid, frequency, state_len)``,
+        fetched *batch_size* at a time at the C level with
+        ``fetchmany()``. The state column is not converted; on Python
+        2 it may be a buffer. The trailing ``state_len`` is computed
+        by sqlite so callers doing size accounting don't need to touch
+        the state object at all.
+
+        This keeps the per-row Python overhead out of this layer so
+        callers can consume each batch in a single tight loop.
+
+        You *must* completely consume the returned object.
+        """
+        # Do this in a new cursor so it can interleave.
         cur = self.connection.cursor()
-        cur.arraysize = 100
-        cur.execute("""
-            SELECT zoid, CASE was_frozen WHEN 1 THEN -1 ELSE tid END,
-                   CAST(state AS BLOB), tid, frequency
-            FROM object_state
-            ORDER BY frequency DESC, tid DESC
-        """)
-        for zoid, frozen, state, tid, frequency in cur:
-            yield zoid, frozen, as_state(state), tid, frequency
+        cur.arraysize = batch_size
+        cur.execute(self._fetch_rows_by_priority_sql)
+        fetchmany = cur.fetchmany
+        while True:
+            rows = fetchmany()
+            if not rows:
+                break
+            yield rows
+        cur.close()
 
     @log_timed
     def list_rows_by_priority(self):
@@ -238,15 +318,57 @@ class Database(ABC):
 
     def store_temp(self, rows):
         """
-        Given an iterator of ``(oid, tid, frozen, state, frequency)`` values,
-        store them in a temporary table for this session.
+        Given an iterator of ``(oid, tid, frozen, state, frequency,
+        generation)`` values, store them in a temporary table for this
+        session.
         """
-        # The batch size depends on how many params a stored proc can
-        # have; if we go too big we get OperationalError: too many SQL
-        # variables. The default is 999.
-        # Note that the multiple-value syntax was added in
-        # 3.7.11, 2012-03-20.
-
+        if SUPPORTS_JSON_BULK_LOAD:
+            return self._store_temp_json(rows)
+        return self._store_temp_executemany(rows)
+
+    #: How many rows ride in each JSON payload given to
+    #: :meth:`_store_temp_json`. This bounds the transient hex-encoded
+    #: copy of the states -- the dominant memory cost of a payload --
+    #: while still amortizing the statement executions.
+    _store_temp_json_batch_size = 5000
+
+    def _store_temp_json(self, rows):
+        # sqlite parses each JSON array in C and the prepared insert
+        # runs once per batch instead of once per row. States ride
+        # along hex-encoded because JSON can't carry blobs; ``unhex``
+        # turns them back into true BLOBs server-side, which
+        # conveniently also sidesteps the text-affinity problem
+        # described in ``_store_temp_executemany``. The rows are
+        # encoded and flushed in bounded batches: this runs at
+        # shutdown, exactly when we can't afford to hold a second,
+        # doubled copy of the whole cache in memory at once.
+        batch_size = self._store_temp_json_batch_size
+        execute = self.cursor.execute
+        sql = self._store_temp_json_sql
+        dumps = json.dumps
+        count = 0
+        encoded = []
+        append = encoded.append
+        for oid, tid, frozen, state, frequency, generation in rows:
+            if state is not None:
+                if not isinstance(state, bytes):
+                    # sqlite's loose typing means Python 2 (and tests)
+                    # can hand us text states. They used to be stored
+                    # with text affinity, but everything that reads
+                    # them back already CASTs to BLOB.
+                    state = state.encode('utf-8')
+                state = hexlify(state).decode('ascii')
+            append((oid, tid, frozen, state, frequency, generation))
+            if len(encoded) >= batch_size:
+                execute(sql, (dumps(encoded),))
+                count += len(encoded)
+                del encoded[:]
+        if encoded:
+            execute(sql, (dumps(encoded),))
+            count += len(encoded)
+        return count, -1
+
+    def _store_temp_executemany(self, rows):
         # Benchmarking shows essentially no difference between this
         # simple method and using our RowBatcher to produce
         # multi-value statements. vmprof shows all of the time spent
@@ -255,6 +377,11 @@ class Database(ABC):
         # 1.1% of the execution of *this* function). I'm Not entirely
         # sure what that means.
 
+        # executemany() loops the one prepared statement in C and is
+        # happy with any iterable, so feed it the rows as they're
+        # produced rather than materializing them into a list first;
+        # we only need a wrapper to keep count of how many went by.
+
         # Because of sqlite's loose typing. on Python 2 we may get
         # state column values stored with TEXT affinity, even though
         # the storage class of the state column is BLOB. On Python 3
@@ -267,14 +394,17 @@ class Database(ABC):
         # We can add a CAST(state as BLOB), or we could set the
         # connection's text_factory to bytes (which makes the metadata
         # bytes too).
-        rows = list(rows) # materialize
-        self.cursor.executemany(
-            'INSERT INTO temp_state(zoid, tid, was_frozen, state, frequency) '
-            'VALUES (?, ?, ?, ?, ?)',
-            rows
-        )
+        count = [0]
+        def counting(rows=rows, count=count):
+            stored = 0
+            for row in rows:
+                stored += 1
+                yield row
+            count[0] = stored
 
-        return len(rows), -1
+        self.cursor.executemany(self._store_temp_sql, counting())
+
+        return count[0], -1
 
     @abstractmethod
     def move_from_temp(self):
@@ -350,112 +480,129 @@ class Database(ABC):
         )
 
 
+    # sqlite's historical limit on bound variables; raised to 32766 in
+    # 3.32 but there's no benefit to probing for that here.
+    _trim_delete_chunk_size = 999
+
     def _trim_state(self, how_much_to_trim):
         # Try to get the oldest, least used, biggest objects we can.
-        # We could probably use a window function over SUM(LENGTH(state))
-        # to limit the select to just the rows we want.
-
-        # We'll be interleaving statements so we must use a
-        # separate cursor
-        batch_cur = self.connection.cursor()
-        batch = Sqlite3RowBatcher(batch_cur)
-
-        # In fact, because of the way PyPy wants you to fetch all rows
-        # or it considers some statements to still be open and thus
-        # refuses to allow things like VACUUM, we need to use two
-        # cursors, so we can close the fetch cursor too
+        # The stop condition is a byte total, not a row count, so we
+        # still walk the rows in eviction order here; but instead of
+        # one parameterized DELETE per victim we collect the zoids and
+        # issue chunked ``DELETE ... WHERE zoid IN (...)`` statements:
+        # hundreds of times fewer statements during a big trim.
+
+        # Because of the way PyPy wants you to fetch all rows or it
+        # considers some statements to still be open and thus refuses
+        # to allow things like VACUUM, we use a separate cursor for
+        # the fetch and close it before deleting.
         fetch_cur = self.connection.cursor()
-        fetch_cur.execute("""
-        SELECT zoid, LENGTH(state)
-        FROM object_state
-        ORDER BY frequency ASC, tid ASC, LENGTH(CAST(state AS BLOB)) DESC, zoid ASC
-        """)
-
-
-        for row in fetch_cur:
-            zoid, size = row
+        fetch_cur.execute(self._trim_fetch_sql)
+        zoids_to_delete = []
+        append = zoids_to_delete.append
+        for zoid, size in fetch_cur:
             how_much_to_trim -= size
-            batch.delete_from('object_state', zoid=zoid)
+            append(zoid)
             if how_much_to_trim <= 0:
                 break
-        batch.flush()
-        batch_cur.close()
         fetch_cur.close()
-        return batch.total_rows_deleted
+
+        rows_deleted = 0
+        chunk_size = self._trim_delete_chunk_size
+        cur = self.cursor
+        for i in range(0, len(zoids_to_delete), chunk_size):
+            chunk = zoids_to_delete[i:i + chunk_size]
+            cur.execute(
+                'DELETE FROM object_state WHERE zoid IN (%s)' % (
+                    ','.join('?' * len(chunk)),),
+                chunk)
+            rows_deleted += cur.rowcount
+        return rows_deleted
 
 class _UpsertUpdateDatabase(Database):
 
+    # "The parser might not be able to tell if the "ON" keyword is
+    # introducing the UPSERT or if it is the ON clause of a join.
+    # To work around this, the SELECT statement should always
+    # include a WHERE clause, even if that WHERE clause is just
+    # ``WHERE true``."
+    _move_from_temp_sql = """
+    INSERT INTO object_state (zoid, tid, was_frozen, frequency, generation, state)
+    SELECT zoid, tid, was_frozen, frequency, generation, state
+    FROM temp_state
+    WHERE true
+    ON CONFLICT(zoid) DO UPDATE
+    SET tid = excluded.tid,
+        was_frozen = excluded.was_frozen,
+        state = excluded.state,
+        frequency = excluded.frequency + object_state.frequency,
+        generation = excluded.generation
+    WHERE excluded.tid >= tid
+    """
+
+    _update_checkpoints_sql = """
+    INSERT INTO checkpoints (id, max_hvt, complete_since)
+    VALUES (0, ?, ?)
+    ON CONFLICT(id) DO UPDATE
+        SET max_hvt = excluded.max_hvt, complete_since = excluded.complete_since
+    WHERE excluded.max_hvt >= max_hvt
+    """
+
     def move_from_temp(self):
-        # "The parser might not be able to tell if the "ON" keyword is
-        # introducing the UPSERT or if it is the ON clause of a join.
-        # To work around this, the SELECT statement should always
-        # include a WHERE clause, even if that WHERE clause is just
-        # ``WHERE true``."
-        self.cursor.execute("""
-        INSERT INTO object_state (zoid, tid, was_frozen, frequency, state)
-        SELECT zoid, tid, was_frozen, frequency, state
-        FROM temp_state
-        WHERE true
-        ON CONFLICT(zoid) DO UPDATE
-        SET tid = excluded.tid,
-            was_frozen = excluded.was_frozen,
-            state = excluded.state,
-            frequency = excluded.frequency + object_state.frequency
-        WHERE excluded.tid >= tid
-        """)
+        self.cursor.execute(self._move_from_temp_sql)
         rows_inserted = self.cursor.rowcount
         self.cursor.execute("DELETE FROM temp_state")
         return rows_inserted
 
     def update_checkpoints(self, cp0, cp1):
-        self.cursor.execute("""
-        INSERT INTO checkpoints (id, max_hvt, complete_since)
-        VALUES (0, ?, ?)
-        ON CONFLICT(id) DO UPDATE
-            SET max_hvt = excluded.max_hvt, complete_since = excluded.complete_since
-        WHERE excluded.max_hvt >= max_hvt
-        """, (cp0, cp1))
+        self.cursor.execute(self._update_checkpoints_sql, (cp0, cp1))
 
 class _InsertReplaceDatabase(Database):
+
+    _delete_stale_temp_sql = """
+    DELETE FROM temp_state
+    WHERE EXISTS (
+        SELECT 1
+        FROM object_state
+        WHERE object_state.zoid = temp_state.zoid
+        AND object_state.tid > temp_state.tid
+    )
+    """
+
+    # The old 'INSERT OR REPLACE' syntax is supported from
+    # 3.0.0 forward. It's not as flexible as the true upsert:
+    # for example, you can't specify the type of conflict, nor
+    # can you use a WHERE clause or specify the values to use
+    # in the update. It also doesn't increment the cursor's change
+    # counter for replaced rows.
+    _move_from_temp_sql = """
+    INSERT OR REPLACE INTO object_state (zoid, tid, was_frozen, state, frequency, generation)
+    SELECT zoid, tid, was_frozen, state, frequency, generation
+    FROM temp_state
+    """
+
+    _update_checkpoints_sql = """
+    INSERT OR REPLACE INTO checkpoints(id, max_hvt, complete_since)
+    SELECT 0, ?, ?
+    FROM checkpoints
+    WHERE max_hvt <= ?
+    UNION
+    SELECT 0, ?, ?
+    WHERE NOT EXISTS (SELECT id FROM checkpoints)
+    """
+
     def move_from_temp(self):
-        # The old 'INSERT OR REPLACE' syntax is supported from
-        # 3.0.0 forward. It's not as flexible as the true upsert:
-        # for example, you can't specify the type of conflict, nor
-        # can you use a WHERE clause or specify the values to use
-        # in the update. It also doesn't increment the cursor's change
-        # counter for replaced rows.
-        self.cursor.execute("""
-        DELETE FROM temp_state
-        WHERE EXISTS (
-            SELECT 1
-            FROM object_state
-            WHERE object_state.zoid = temp_state.zoid
-            AND object_state.tid > temp_state.tid
-        )
-        """)
+        self.cursor.execute(self._delete_stale_temp_sql)
         self.cursor.execute('SELECT COUNT(*) FROM temp_state')
         rows_inserted = self.cursor.fetchall()[0][0]
 
-        self.cursor.execute("""
-        INSERT OR REPLACE INTO object_state (zoid, tid, was_frozen, state, frequency)
-        SELECT zoid, tid, was_frozen, state, frequency
-        FROM temp_state
-        """)
+        self.cursor.execute(self._move_from_temp_sql)
 
         self.cursor.execute("DELETE FROM temp_state")
         return rows_inserted
 
     def update_checkpoints(self, cp0, cp1):
-        cur = self.cursor
-        cur.execute("""
-        INSERT OR REPLACE INTO checkpoints(id, max_hvt, complete_since)
-        SELECT 0, ?, ?
-        FROM checkpoints
-        WHERE max_hvt <= ?
-        UNION
-        SELECT 0, ?, ?
-        WHERE NOT EXISTS (SELECT id FROM checkpoints)
-        """, (
+        self.cursor.execute(self._update_checkpoints_sql, (
             cp0, cp1,
             cp0,
             cp0, cp1
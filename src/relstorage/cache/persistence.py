@@ -146,6 +146,18 @@ def sqlite_connect(options, prefix,
     if not SQ3_IS_MIN_VERSION: # pragma: no cover
         raise Sqlite3TooOldError()
 
+    # Unlike the main storage, this database is used in two big
+    # bursts: one sequential read of the whole object_state table at
+    # startup, and one big write transaction at shutdown. Give it a
+    # generous mmap (sequential page reads become memcpy from mapped
+    # pages), a bigger page cache than the compiled-in default, and
+    # keep temporary tables in memory. The driver already arranges
+    # WAL mode and synchronous=NORMAL. Callers can override any of
+    # this through *connect_kwargs*.
+    connect_kwargs.setdefault('mmap_size', 268435456)
+    connect_kwargs.setdefault('cache_size', -65536)
+    connect_kwargs.setdefault('temp_store', 2) # MEMORY
+
     fname, destroy = sqlite_files(options, prefix)
 
     corrupt_db_ex = CORRUPT_DB_EXCEPTIONS
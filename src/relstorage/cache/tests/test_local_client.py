@@ -16,10 +16,13 @@ from __future__ import division
 from __future__ import print_function
 
 import threading
+import unittest
 from functools import partial
 
 from relstorage.tests import TestCase
 
+from relstorage.cache.local_client import _zstd_compress
+
 from . import LocalClient
 from . import MockOptions
 from . import list_lrukeys as list_lrukeys_
@@ -249,6 +252,75 @@ class LocalClientOIDTests(AbstractStateCacheTests):
         self.assertEqual(c[self.key], self.value)
         self.assertEqual(c[self.missing_key], None)
 
+    @unittest.skipIf(_zstd_compress is None, "Requires zstandard")
+    def test_set_and_get_string_zstd(self):
+        c = self._makeOne(cache_local_compression='zstd')
+        c[self.key] = self.value
+        self.assertEqual(c[self.key], self.value)
+        self.assertEqual(c[self.missing_key], None)
+
+    @unittest.skipIf(_zstd_compress is None, "Requires zstandard")
+    def test_zstd_data_readable_with_other_codec(self):
+        # Decompression dispatches on the marker stored with the
+        # data, so a cache written with zstd stays readable after
+        # the configured compression module changes.
+        writer = self._makeOne(cache_local_compression='zstd')
+        state = b'x' * 120
+        compressed = writer._compress(state)
+        self.assertTrue(compressed.startswith(b'.s'))
+        for module in 'none', 'zlib', 'bz2':
+            reader = self._makeOne(cache_local_compression=module)
+            self.assertEqual(reader._decompress(compressed), state)
+
+    def test_compress_learns_to_skip_incompressible(self):
+        import os
+        c = self._makeOne(cache_local_compression='zlib')
+        # 120 bytes: big enough to qualify for compression, and in
+        # the smallest size bucket.
+        incompressible = os.urandom(120)
+        bucket = min(7, len(incompressible).bit_length() - 7)
+        # Feeding it nothing but entropy drives the learned ratio for
+        # the bucket over the cutoff. (zlib expands pure entropy, so
+        # each attempt also comes back uncompressed.)
+        for _ in range(100):
+            if c._compress_ratio_ewma[bucket] >= c._compress_ratio_cutoff:
+                break
+            self.assertEqual(c._compress(incompressible), incompressible)
+        else:
+            self.fail("Never learned the bucket is incompressible")
+        # Now even a compressible value of that size isn't attempted.
+        compressible = b'x' * 120
+        self.assertEqual(c._compress(compressible), compressible)
+        self.assertEqual(c._compress_skipped[bucket], 1)
+
+    def test_compress_probes_after_skipping(self):
+        c = self._makeOne(cache_local_compression='zlib')
+        compressible = b'x' * 120
+        bucket = min(7, len(compressible).bit_length() - 7)
+        c._compress_ratio_ewma[bucket] = 1.0
+        # Skip up to the probe threshold...
+        for _ in range(c._compress_skip_probe - 1):
+            self.assertEqual(c._compress(compressible), compressible)
+        # ...then one value is compressed anyway, and the observed
+        # ratio pulls the learned estimate back down.
+        self.assertNotEqual(c._compress(compressible), compressible)
+        self.assertEqual(c._compress_skipped[bucket], 0)
+        self.assertLess(c._compress_ratio_ewma[bucket], 1.0)
+
+    def test_compress_relearns_after_probe(self):
+        c = self._makeOne(cache_local_compression='zlib')
+        compressible = b'x' * 120
+        bucket = min(7, len(compressible).bit_length() - 7)
+        # Just over the cutoff and about to probe: one good result is
+        # enough to re-enable the bucket.
+        c._compress_ratio_ewma[bucket] = c._compress_ratio_cutoff
+        c._compress_skipped[bucket] = c._compress_skip_probe - 1
+        self.assertNotEqual(c._compress(compressible), compressible)
+        self.assertLess(c._compress_ratio_ewma[bucket], c._compress_ratio_cutoff)
+        # Back to compressing unconditionally.
+        self.assertNotEqual(c._compress(compressible), compressible)
+        self.assertEqual(c._compress_skipped[bucket], 0)
+
     def test_set_and_get_string_uncompressed(self):
         c = self._makeOne(cache_local_compression='none')
         c[self.key] = self.value
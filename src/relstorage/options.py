@@ -59,6 +59,9 @@ class Options(object):
        Since packing no longer holds the commit lock, ``pack_batch_timeout`` is the interval
        between committing deletions. Changed from 1.0s to 15s.
        Note that this is not universally applied.
+
+    .. versionchanged:: 3.5.0
+       Add the ``connection_pool_size`` option.
     """
 
     #: The adapter factory configuration.
@@ -132,6 +135,12 @@ class Options(object):
     #: Lock ID for Oracle
     commit_lock_id = 0
 
+    #: How many closed-but-healthy server connections to keep around
+    #: for reuse by later opens, skipping the connection handshake.
+    #: Set to 0 to disable the reuse. Currently only PostgreSQL
+    #: honors this.
+    connection_pool_size = 4
+
     #: Automatically create the schema if needed
     create_schema = True
     #: Which database driver to use